@@ -152,7 +152,7 @@ def node_llm_analyze(state: AgentState) -> dict:
 
         step.input_summary = f"Document ({len(document_text)} chars) + guidelines"
 
-        # LCEL chain takes the input text directly as a string
+        # The RAG pipeline takes the input text directly as a string
         raw_answer = chain.invoke(document_text)
 
         step.output_summary = f"LLM response: {len(raw_answer)} chars"
@@ -494,7 +494,7 @@ async def run_agent_analysis(
             detailed_analysis=f"Agent error: {str(e)}",
             guidelines_checked=0,
             processing_time_seconds=round(time.time() - start_time, 2),
-        )
+        ).mark_degraded()
         return fallback, {"error": str(e), "steps": []}
 
     # Build the final AnalysisResult
@@ -514,6 +514,9 @@ async def run_agent_analysis(
         )
 
     result.processing_time_seconds = round(time.time() - start_time, 2)
+    if final_state.get("error"):
+        # A node failed and substituted a placeholder (e.g. LLM or retrieval outage)
+        result.mark_degraded()
 
     trace_dict = final_state.get("trace", {})
     if isinstance(trace_dict, dict):
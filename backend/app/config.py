@@ -33,6 +33,7 @@ class Settings(BaseSettings):
     ENVIRONMENT: Environment = Environment.DEVELOPMENT
     DEBUG: bool = True
     API_PREFIX: str = "/api/v1"
+    WEB_CONCURRENCY: int = 4  # Server worker processes (ignored with reload in DEBUG)
 
     # --- Security ---
     SECRET_KEY: str = Field(
@@ -54,8 +55,16 @@ class Settings(BaseSettings):
 
     # --- LLM ---
     LLM_PROVIDER: LLMProvider = LLMProvider.OLLAMA
+    LLM_TEMPERATURE: float = 0.0  # Deterministic output for extraction/classification
+    LLM_MAX_TOKENS: int = 2048  # Output cap for hosted providers (Ollama uses OLLAMA_NUM_PREDICT)
     OLLAMA_HOST: str = "http://localhost:11434"
-    OLLAMA_MODEL: str = "mistral"
+    OLLAMA_MODEL: str = "mistral:7b-instruct-q4_K_M"  # 4-bit quantized — ~2-4x faster decode
+    OLLAMA_NUM_CTX: int = 8192  # Prompt (guidelines + application) plus generated JSON
+    OLLAMA_NUM_PREDICT: int = 1024
+    OLLAMA_KEEP_ALIVE: str = "30m"  # Keep weights loaded between requests
+    HTTP_POOL_SIZE: int = 10  # Pooled keep-alive connections to the model server
+    OLLAMA_EMBED_MODEL: str = "nomic-embed-text"  # Dedicated embedder — far cheaper than the chat model
+    OLLAMA_EMBED_BATCH_SIZE: int = 32  # Chunks per /api/embed request (128 suits GPU hosts)
     OPENAI_API_KEY: str = ""
     OPENAI_MODEL: str = "gpt-4o"
 
@@ -68,6 +77,7 @@ class Settings(BaseSettings):
     # --- Anthropic ---
     ANTHROPIC_API_KEY: str = ""
     ANTHROPIC_MODEL: str = "claude-sonnet-4-20250514"
+    ANTHROPIC_MAX_TOKENS: int = 4096  # Room for the full JSON report; overrides LLM_MAX_TOKENS
 
     # --- OpenRouter ---
     OPENROUTER_API_KEY: str = ""
@@ -83,14 +93,32 @@ class Settings(BaseSettings):
     CHROMA_PERSIST_DIR: str = "./chroma_db"
     CHROMA_COLLECTION_NAME: str = "underwriting_guidelines"
     VECTOR_SEARCH_K: int = 5
+    # Characters per guideline chunk (~500 tokens — well within the embedder's context).
+    # Fewer, larger chunks mean fewer embeddings and a smaller index to search.
+    GUIDELINE_CHUNK_SIZE: int = 2000
+    GUIDELINE_CHUNK_OVERLAP: int = 100
+    CHROMA_HNSW_SPACE: str = "cosine"  # Distance metric: cosine, ip, or l2
+    CHROMA_HNSW_M: int = 32
+    CHROMA_HNSW_CONSTRUCTION_EF: int = 200
+    CHROMA_HNSW_SEARCH_EF: int = 64
+    RETRIEVAL_CACHE_SIZE: int = 256
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 60 * 60  # 1 hour
+    RETRIEVAL_CACHE_SIMILARITY: float = 0.98  # Cosine similarity treated as "same query"
 
     # --- Document Processing ---
     MAX_FILE_SIZE_MB: int = 25
+    APPLICATION_MAX_INPUT_TOKENS: int = 3000  # Longer applications are reduced to relevant sections
+    APPLICATION_RELEVANCE_THRESHOLD: float = 0.7  # Min cosine similarity to any guideline chunk
+    PDF_PARALLEL_MIN_PAGES: int = 32  # Smaller PDFs are extracted in-process
+    PDF_EXTRACT_WORKERS: int = 0  # Per server worker (0 = CPUs // WEB_CONCURRENCY, clamped to 2-4)
     ALLOWED_EXTENSIONS: list[str] = ["pdf", "docx", "txt"]
 
     # --- Rate Limiting & Caching ---
     RATE_LIMIT_PER_MINUTE: int = 30
     REDIS_URL: str = "redis://localhost:6379/0"
+    ANALYSIS_CACHE_BACKEND: str = "memory"  # "memory" (per worker) or "redis" (shared)
+    ANALYSIS_CACHE_SIZE: int = 256
+    ANALYSIS_CACHE_TTL_SECONDS: int = 60 * 60 * 24  # 24 hours
 
     # --- Integrations: Salesforce ---
     SF_USERNAME: str = ""
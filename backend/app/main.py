@@ -3,6 +3,7 @@ Intelligent Underwriting Assistant — FastAPI Application
 Commercial-grade entry point with structured logging, CORS, and API versioning.
 """
 
+import asyncio
 import logging
 import sys
 from contextlib import asynccontextmanager
@@ -13,9 +14,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.config import get_settings
 from app.exceptions import AppException, app_exception_handler, generic_exception_handler
 from app.middleware.logging import RequestLoggingMiddleware
+from app.middleware.upload_limit import UploadSizeLimitMiddleware
 from app.models.database import create_tables
-from app.services.vector_service import build_vector_db
-from app.services.ai_service import build_rag_chain
+from app.services.document_service import shutdown_pdf_executor
+from app.services.vector_service import build_vector_db, warm_up_embeddings
+from app.services.ai_service import build_rag_chain, warm_up_llm
 
 settings = get_settings()
 
@@ -78,6 +81,17 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error("Failed to build RAG chain: %s", e)
 
+        # 3b. Preload models so the first request doesn't pay the load cost
+        logger.info("Warming up models...")
+        try:
+            await asyncio.gather(
+                asyncio.to_thread(warm_up_embeddings),
+                asyncio.to_thread(warm_up_llm),
+            )
+            logger.info("Models warmed up.")
+        except Exception as e:
+            logger.warning("Model warm-up failed (first request will load them): %s", e)
+
     # 4. Register enterprise integrations
     logger.info("Registering enterprise integrations...")
     _register_integrations()
@@ -87,9 +101,10 @@ async def lifespan(app: FastAPI):
 
     yield  # App is running
 
-    # Shutdown: disconnect integrations
+    # Shutdown: disconnect integrations, stop PDF extraction processes
     from app.integrations.base import integration_registry
     await integration_registry.disconnect_all()
+    shutdown_pdf_executor()
     logger.info("Shutting down...")
 
 
@@ -108,6 +123,9 @@ app = FastAPI(
 
 # ── Middleware ─────────────────────────────────────────────────────
 
+# Refuses oversize uploads before or while the body is read (inside CORS so the 413 is readable)
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS,
@@ -175,9 +193,12 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
+    # Workers share the Ollama server (one copy of the weights) and the
+    # persisted vector index, so they scale without re-loading either.
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
         reload=settings.DEBUG,
+        workers=None if settings.DEBUG else settings.WEB_CONCURRENCY,
     )
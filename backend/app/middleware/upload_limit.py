@@ -0,0 +1,92 @@
+"""
+Upload size limit middleware.
+
+Rejects requests whose body is over the upload limit before it is spooled
+to disk, hashed or parsed. A declared Content-Length over the limit is
+refused without reading anything; otherwise (e.g. chunked uploads) body
+bytes are counted as they arrive and the request is cut off with a 413 as
+soon as the limit is passed.
+"""
+
+import logging
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import get_settings
+from app.exceptions import FileTooLargeError, app_exception_handler
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Headroom for the multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class _BodyTooLarge(Exception):
+    """Raised from receive() to stop the app reading an oversize body."""
+
+
+class UploadSizeLimitMiddleware:
+    """Answer 413 for request bodies over MAX_FILE_SIZE_MB, declared or streamed."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES
+        content_length = _content_length(scope)
+        if content_length is not None and content_length > max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            # Drop whatever error response the app built from the aborted read
+            if exceeded and not response_started:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded and not response_started:
+            logger.warning("Request body over %d bytes aborted: %s", max_bytes, scope["path"])
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send) -> None:
+        response = await app_exception_handler(
+            Request(scope), FileTooLargeError(settings.MAX_FILE_SIZE_MB)
+        )
+        await response(scope, receive, send)
+
+
+def _content_length(scope: Scope) -> int | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
@@ -4,7 +4,7 @@ Pydantic schemas for API request/response models.
 
 from datetime import datetime
 from enum import Enum
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, PrivateAttr
 
 
 # ── Enums ──────────────────────────────────────────────────────────
@@ -77,6 +77,18 @@ class AnalysisResult(BaseModel):
     guidelines_checked: int = Field(0, description="Number of guidelines checked")
     processing_time_seconds: float = 0.0
 
+    # Not serialized: a fallback result is returned to the caller but never cached
+    _degraded: bool = PrivateAttr(default=False)
+
+    @property
+    def degraded(self) -> bool:
+        """True if the pipeline hit an error and this is a fallback result."""
+        return self._degraded
+
+    def mark_degraded(self) -> "AnalysisResult":
+        self._degraded = True
+        return self
+
 
 class AnalysisResponse(BaseModel):
     """API response wrapping the analysis result."""
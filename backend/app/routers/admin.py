@@ -4,6 +4,7 @@ Admin endpoints for managing users, guidelines, settings, and API keys.
 Accessible only to users with the 'admin' role.
 """
 
+import asyncio
 import csv
 import io
 import logging
@@ -25,6 +26,8 @@ from app.models.schemas import (
 )
 from app.services.api_key_service import create_api_key, list_api_keys, revoke_api_key
 from app.services.vector_service import build_vector_db
+from app.services.ai_service import build_rag_chain
+from app.services.cache_service import get_analysis_cache
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -138,8 +141,16 @@ async def upload_guidelines(
             
         logger.info("Admin %s uploaded new guidelines: %s", admin.email, file.filename)
         
-        # Rebuild Chroma DB blocking (in production, use background task)
-        build_vector_db(force_rebuild=True)
+        # Rebuild Chroma DB in a worker thread: embedding the guidelines (or
+        # waiting on another worker's build lock) must not block the event loop.
+        # The index is keyed by the guidelines hash, so new content always rebuilds.
+        retriever = await asyncio.to_thread(build_vector_db)
+        await asyncio.to_thread(build_rag_chain, retriever)
+
+        # Other workers rebuild when they next see the changed file. Cache keys
+        # include the index version, so old analyses are already unreachable;
+        # clearing just frees their space on this worker/Redis.
+        await get_analysis_cache().clear()
         
         return {"message": "Guidelines updated and vector database rebuilt."}
         
@@ -2,8 +2,10 @@
 Analysis router: upload and analyze loan applications, view history, dashboard.
 """
 
+import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
+from typing import BinaryIO
 
 from fastapi import APIRouter, Depends, UploadFile, File, Query, Request
 from sqlalchemy import select, func, desc
@@ -20,8 +22,10 @@ from app.models.schemas import (
     DashboardMetrics,
     RiskLevel,
 )
-from app.services.document_service import extract_text
-from app.services.ai_service import analyze_document
+from app.services.document_service import extract_text, validate_file
+from app.services.ai_service import analyze_document, refresh_if_guidelines_changed
+from app.services.cache_service import get_analysis_cache, hash_document, make_cache_key
+from app.services.vector_service import get_index_version
 from app.services.auth_service import log_audit
 
 logger = logging.getLogger(__name__)
@@ -45,6 +49,47 @@ def _get_active_llm_model() -> str:
     return settings.OLLAMA_MODEL
 
 
+async def _read_upload(file: UploadFile) -> tuple[str, str, int]:
+    """
+    Validate and hash an upload in chunks, leaving it in its spooled temp file.
+    Returns (filename, analysis cache key, size in bytes).
+    """
+    filename = file.filename or "unknown"
+    validate_file(filename, file.file)
+    digest, size = await asyncio.to_thread(hash_document, file.file)
+    # Pick up guidelines uploaded through another worker before keying the cache
+    await asyncio.to_thread(refresh_if_guidelines_changed)
+    cache_key = make_cache_key(digest, _get_active_llm_model(), get_index_version())
+    return filename, cache_key, size
+
+
+async def _analyze_cached(
+    filename: str,
+    cache_key: str,
+    source: BinaryIO | None = None,
+    application_text: str | None = None,
+) -> AnalysisResult:
+    """
+    Run the analysis pipeline unless this exact document was already analyzed
+    with the active model, in which case the cached result is returned.
+    Fallback results from a failed run are returned but not cached.
+    """
+    cache = get_analysis_cache()
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        logger.info("Analysis cache hit for %s", filename)
+        return cached
+
+    if application_text is None:
+        # CPU-bound — keep it off the event loop
+        application_text = await asyncio.to_thread(extract_text, filename, source)
+    result = await analyze_document(application_text, filename=filename)
+    if result.degraded:
+        logger.warning("Not caching degraded analysis for %s", filename)
+    else:
+        await cache.set(cache_key, result)
+    return result
+
 
 @router.post("", response_model=AnalysisResponse, status_code=201)
 async def create_analysis(
@@ -57,23 +102,19 @@ async def create_analysis(
     Upload and analyze a loan application document.
     Returns a structured risk analysis with scores, flags, and recommendations.
     """
-    # 1. Read file
-    contents = await file.read()
-    filename = file.filename or "unknown"
+    # 1. Validate and hash the upload (parsed straight from its temp file)
+    filename, cache_key, file_size = await _read_upload(file)
 
-    logger.info("User %s uploading file: %s (%d bytes)", current_user.email, filename, len(contents))
+    logger.info("User %s uploading file: %s (%d bytes)", current_user.email, filename, file_size)
 
-    # 2. Extract text
-    application_text = extract_text(filename, contents)
+    # 2. Extract text and run AI analysis (skipped for previously analyzed files)
+    result: AnalysisResult = await _analyze_cached(filename, cache_key, source=file.file)
 
-    # 3. Run AI analysis
-    result: AnalysisResult = await analyze_document(application_text, filename=filename)
-
-    # 4. Persist the analysis
+    # 3. Persist the analysis
     record = AnalysisRecord(
         user_id=current_user.id,
         filename=filename,
-        file_size_bytes=len(contents),
+        file_size_bytes=file_size,
         summary=result.summary,
         overall_risk_score=result.overall_risk_score,
         overall_risk_level=result.overall_risk_level.value if isinstance(result.overall_risk_level, RiskLevel) else result.overall_risk_level,
@@ -89,7 +130,7 @@ async def create_analysis(
     await db.flush()
     await db.refresh(record)
 
-    # 5. Audit log
+    # 4. Audit log
     await log_audit(
         db=db,
         action="analyze",
@@ -124,18 +165,17 @@ async def create_analysis_task(
     Returns a task_id that can be used to stream Server-Sent Events (SSE).
     """
     from app.services.task_service import create_task, run_analysis_task
-    import asyncio
 
-    contents = await file.read()
-    filename = file.filename or "unknown"
-    application_text = extract_text(filename, contents)
+    # The upload is closed once the response is sent, so extract text up front
+    filename, cache_key, file_size = await _read_upload(file)
+    application_text = await asyncio.to_thread(extract_text, filename, file.file)
 
     # Capture values needed in the background closure before request context closes
     user_id = current_user.id
     client_ip = request.client.host if request.client else None
 
     async def wrapped_analysis(text: str, fname: str):
-        result = await analyze_document(text, filename=fname)
+        result = await _analyze_cached(fname, cache_key, application_text=text)
 
         # Use a fresh DB session — the request-scoped session is closed by the time this runs
         from app.models.database import get_session_factory
@@ -144,7 +184,7 @@ async def create_analysis_task(
             record = AnalysisRecord(
                 user_id=user_id,
                 filename=fname,
-                file_size_bytes=len(contents),
+                file_size_bytes=file_size,
                 summary=result.summary,
                 overall_risk_score=result.overall_risk_score,
                 overall_risk_level=result.overall_risk_level.value if isinstance(result.overall_risk_level, RiskLevel) else result.overall_risk_level,
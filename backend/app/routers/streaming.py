@@ -5,16 +5,24 @@ Allows clients to subscribe to real-time progress updates for
 background analysis tasks.
 """
 
-from fastapi import APIRouter, Depends, Query, HTTPException, Request
+import asyncio
+
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, UploadFile, File
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from app.dependencies import get_db
+from app.dependencies import get_db, get_current_user
 # Remove auth dependency to make streaming endpoint easily accessible from EventSource API
 # The auth token should ideally be passed in GET parameters if strict auth is needed for SSE
 
-from app.models.database import BackgroundTask
+from app.models.database import BackgroundTask, User
+from app.services.ai_service import (
+    get_rag_chain,
+    refresh_if_guidelines_changed,
+    stream_rag_analysis,
+)
+from app.services.document_service import extract_text
 from app.services.task_service import sse_generator
 
 router = APIRouter(prefix="/stream", tags=["Streaming"])
@@ -75,3 +83,30 @@ async def stream_task_progress(
         sse_generator(task_id),
         media_type="text/event-stream"
     )
+
+
+@router.post("/analysis")
+async def stream_analysis(
+    file: UploadFile = File(..., description="Loan application document (PDF, DOCX, or TXT)"),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Analyze a document and stream the raw LLM output as plain text while it
+    is generated, so clients can render progress immediately.
+
+    The streamed output is not persisted — use POST /analysis for a stored,
+    structured result. If the analysis fails mid-stream the connection is
+    aborted without a terminating chunk, so a truncated body is never
+    mistaken for a complete one.
+    """
+    filename = file.filename or "unknown"
+    application_text = await asyncio.to_thread(extract_text, filename, file.file)
+
+    # Fail with a proper status code before the stream starts
+    await asyncio.to_thread(refresh_if_guidelines_changed)
+    get_rag_chain()
+
+    return StreamingResponse(
+        stream_rag_analysis(application_text),
+        media_type="text/plain",
+    )
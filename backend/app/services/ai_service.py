@@ -4,26 +4,37 @@ AI analysis service: LLM orchestration with agentic pipeline.
 This service now delegates to the LangGraph agent for multi-step
 analysis, while keeping the RAG chain as a fallback.
 
-Compatible with LangChain v1.0+ (uses LCEL — no langchain.chains).
+The RAG chain is a plain pipeline object (no LCEL / langchain.chains),
+so the hot path carries no Runnable graph overhead.
 """
 
 import json
 import time
+import asyncio
 import logging
-from typing import Any
+import threading
+from functools import lru_cache
+from string import Template
+from typing import Any, AsyncIterator
 
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.messages import SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
 
 from app.config import get_settings, LLMProvider
 from app.models.schemas import AnalysisResult, RiskFlag, RiskLevel
 from app.exceptions import AIServiceError
+from app.services.vector_service import (
+    build_vector_db,
+    get_http_session,
+    guidelines_changed,
+    select_relevant_text,
+)
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 _rag_chain = None
+_refresh_lock = threading.Lock()
 
 
 # ── Prompt Template ────────────────────────────────────────────────
@@ -66,6 +77,18 @@ IMPORTANT RULES:
 - Risk score guidelines: 0-25=low, 26-50=moderate, 51-75=high, 76-100=critical
 """
 
+# Compiled once: substituting into a string.Template is far cheaper than
+# re-parsing the prompt through ChatPromptTemplate on every request.
+_PROMPT_TEMPLATE = Template(
+    SYSTEM_PROMPT.replace("{{", "{").replace("}}", "}")
+    .replace("{context}", "$context").replace("{input}", "$input")
+)
+
+
+def render_prompt(context: str, application_text: str) -> str:
+    """Fill the system prompt with retrieved guidelines and the application."""
+    return _PROMPT_TEMPLATE.substitute(context=context, input=application_text)
+
 
 def _get_llm():
     """Get the LLM based on the configured provider."""
@@ -78,7 +101,8 @@ def _get_llm():
             return ChatOpenAI(
                 api_key=settings.OPENAI_API_KEY,
                 model=settings.OPENAI_MODEL,
-                temperature=0.1,
+                temperature=settings.LLM_TEMPERATURE,
+                max_tokens=settings.LLM_MAX_TOKENS,
             )
         except ImportError:
             logger.warning("langchain-openai not installed, falling back to Ollama")
@@ -92,7 +116,8 @@ def _get_llm():
                 api_key=settings.AZURE_OPENAI_API_KEY,
                 azure_deployment=settings.AZURE_OPENAI_DEPLOYMENT,
                 api_version=settings.AZURE_OPENAI_API_VERSION,
-                temperature=0.1,
+                temperature=settings.LLM_TEMPERATURE,
+                max_tokens=settings.LLM_MAX_TOKENS,
             )
         except ImportError:
             logger.warning("langchain-openai not installed, falling back to Ollama")
@@ -104,8 +129,8 @@ def _get_llm():
             return ChatAnthropic(
                 api_key=settings.ANTHROPIC_API_KEY,
                 model=settings.ANTHROPIC_MODEL,
-                temperature=0.1,
-                max_tokens=4096,
+                temperature=settings.LLM_TEMPERATURE,
+                max_tokens=settings.ANTHROPIC_MAX_TOKENS,
             )
         except ImportError:
             logger.warning("langchain-anthropic not installed, falling back to Ollama")
@@ -119,8 +144,8 @@ def _get_llm():
                 api_key=settings.OPENROUTER_API_KEY,
                 base_url=settings.OPENROUTER_BASE_URL,
                 model=model_name,
-                temperature=0.1,
-                max_tokens=2048,
+                temperature=settings.LLM_TEMPERATURE,
+                max_tokens=settings.LLM_MAX_TOKENS,
                 default_headers={
                     "HTTP-Referer": "https://underwriting-assistant.app",
                     "X-Title": settings.APP_NAME,
@@ -135,37 +160,100 @@ def _get_llm():
     return OllamaLLM(
         model=settings.OLLAMA_MODEL,
         base_url=settings.OLLAMA_HOST,
-        temperature=0.1,
+        temperature=settings.LLM_TEMPERATURE,
+        top_p=1.0,
+        repeat_penalty=1.05,
+        num_ctx=settings.OLLAMA_NUM_CTX,
+        num_predict=settings.OLLAMA_NUM_PREDICT,
+        keep_alive=settings.OLLAMA_KEEP_ALIVE,
+        # Constrain decoding to a JSON object — generation stops once it closes
+        format="json",
+    )
+
+
+def warm_up_llm() -> None:
+    """
+    Load the local Ollama model into memory so the first analysis request
+    does not pay the multi-second model load. Hosted providers are skipped.
+    """
+    if settings.LLM_PROVIDER != LLMProvider.OLLAMA:
+        return
+
+    # A generate request without a prompt only loads the model. num_ctx must
+    # match _get_llm(), or the first real request reloads the runner.
+    response = get_http_session().post(
+        f"{settings.OLLAMA_HOST.rstrip('/')}/api/generate",
+        json={
+            "model": settings.OLLAMA_MODEL,
+            "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+            "options": {"num_ctx": settings.OLLAMA_NUM_CTX},
+        },
+        timeout=300,
     )
+    response.raise_for_status()
+    logger.info("LLM loaded: %s", settings.OLLAMA_MODEL)
+
+
+@lru_cache(maxsize=256)
+def _join_context(chunks: tuple[str, ...]) -> str:
+    return "\n\n".join(chunks)
 
 
 def _format_docs(docs) -> str:
-    """Concatenate retrieved document chunks into a single context string."""
-    return "\n\n".join(doc.page_content for doc in docs)
+    """
+    Concatenate retrieved document chunks into a single context string.
+    Memoized: the retrieval cache hands back the same chunks for repeat queries.
+    """
+    return _join_context(tuple(doc.page_content for doc in docs))
 
 
-def build_rag_chain(retriever):
+def _output_text(output: Any) -> str:
+    """Text of an LLM output — a str for completion models, a message (chunk) for chat models."""
+    if isinstance(output, str):
+        return output
+    content = output.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+class RAGPipeline:
     """
-    Build the RAG chain using LCEL (LangChain Expression Language).
-    Compatible with LangChain v1.0+ (no langchain.chains dependency).
+    Retrieval-augmented analysis: trim input → retrieve guidelines → prompt → LLM.
+
+    Calls the retriever and LLM directly instead of composing LCEL Runnables,
+    and exposes the same invoke / ainvoke / astream interface the chain had.
     """
+
+    def __init__(self, retriever, llm):
+        self.retriever = retriever
+        self.llm = llm
+
+    def _build_prompt(self, application_text: str) -> ChatPromptValue:
+        text = select_relevant_text(application_text, self.retriever)
+        docs = self.retriever.invoke(text)
+        content = render_prompt(_format_docs(docs), text)
+        return ChatPromptValue(messages=[SystemMessage(content=content)])
+
+    def invoke(self, application_text: str) -> str:
+        return _output_text(self.llm.invoke(self._build_prompt(application_text)))
+
+    async def ainvoke(self, application_text: str) -> str:
+        # Retrieval embeds the query over blocking HTTP — keep it off the event loop
+        prompt = await asyncio.to_thread(self._build_prompt, application_text)
+        return _output_text(await self.llm.ainvoke(prompt))
+
+    async def astream(self, application_text: str) -> AsyncIterator[str]:
+        prompt = await asyncio.to_thread(self._build_prompt, application_text)
+        async for chunk in self.llm.astream(prompt):
+            yield _output_text(chunk)
+
+
+def build_rag_chain(retriever):
+    """Build the RAG pipeline for the given retriever and the configured LLM."""
     global _rag_chain
 
-    llm = _get_llm()
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM_PROMPT)
-    ])
-
-    # LCEL pipeline: retrieve → format docs → prompt → llm → parse string
-    _rag_chain = (
-        {
-            "context": retriever | RunnableLambda(_format_docs),
-            "input": RunnablePassthrough(),
-        }
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+    _rag_chain = RAGPipeline(retriever, _get_llm())
 
     model_name = _get_active_model_name()
     logger.info("RAG chain built successfully (provider=%s, model=%s)",
@@ -173,6 +261,25 @@ def build_rag_chain(retriever):
     return _rag_chain
 
 
+def refresh_if_guidelines_changed() -> None:
+    """
+    Rebuild the retriever and RAG chain if the guidelines file changed on disk
+    since this worker built them. An admin upload rebuilds only the worker that
+    handled it; the others catch up here on their next request, loading the
+    index that worker persisted. On failure the current index stays in use.
+    """
+    if not guidelines_changed():
+        return
+    with _refresh_lock:
+        if not guidelines_changed():
+            return
+        logger.info("Guidelines changed on disk, rebuilding retriever and RAG chain")
+        try:
+            build_rag_chain(build_vector_db())
+        except Exception as e:
+            logger.error("Failed to rebuild for changed guidelines (keeping current index): %s", e)
+
+
 def get_rag_chain():
     """Get the current RAG chain."""
     if _rag_chain is None:
@@ -216,7 +323,7 @@ def _parse_llm_response(raw_response: str) -> AnalysisResult:
             recommendation="MANUAL_REVIEW",
             detailed_analysis=raw_response,
             guidelines_checked=0,
-        )
+        ).mark_degraded()
 
     risk_flags = []
     for flag_data in data.get("risk_flags", []):
@@ -289,8 +396,8 @@ async def analyze_document(application_text: str, filename: str = "unknown") ->
 
     try:
         logger.info("Starting direct RAG analysis (text length=%d chars)...", len(application_text))
-        # LCEL chain now returns a string directly (StrOutputParser)
-        raw_answer = chain.invoke(application_text)
+        # The pipeline returns the LLM output as a string
+        raw_answer = await chain.ainvoke(application_text)
 
         result = _parse_llm_response(raw_answer)
         result.processing_time_seconds = round(time.time() - start_time, 2)
@@ -308,3 +415,21 @@ async def analyze_document(application_text: str, filename: str = "unknown") ->
         elapsed = round(time.time() - start_time, 2)
         logger.exception("AI analysis failed after %.2fs: %s", elapsed, e)
         raise AIServiceError(f"Analysis failed: {str(e)}")
+
+
+async def stream_rag_analysis(application_text: str) -> AsyncIterator[str]:
+    """
+    Stream the direct RAG chain output as it is generated.
+    Yields raw text chunks; the caller is responsible for parsing the final JSON.
+    Failures mid-stream propagate so the response is aborted, not completed.
+    """
+    chain = get_rag_chain()
+    logger.info("Starting streamed RAG analysis (text length=%d chars)...", len(application_text))
+    try:
+        async for chunk in chain.astream(application_text):
+            yield chunk
+    except Exception as e:
+        # Headers are already sent. Re-raise so the server aborts the chunked
+        # response instead of ending it cleanly on truncated JSON.
+        logger.exception("Streamed AI analysis failed: %s", e)
+        raise
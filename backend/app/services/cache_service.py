@@ -0,0 +1,114 @@
+"""
+Analysis result cache: skips the whole LLM pipeline for documents that
+were already analyzed with the same model.
+
+Entries are keyed by a hash of the uploaded bytes and by the guidelines
+index version, so results made against older guidelines are never served.
+An in-process LRU is used by default; set ANALYSIS_CACHE_BACKEND=redis to
+share hits across workers.
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import BinaryIO
+
+from app.config import get_settings
+from app.models.schemas import AnalysisResult
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def hash_document(fp: BinaryIO, chunk_size: int = 1024 * 1024) -> tuple[str, int]:
+    """
+    Hash a file object in chunks without reading it into memory.
+    Returns (hex digest, size in bytes) and rewinds the file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    fp.seek(0)
+    while chunk := fp.read(chunk_size):
+        digest.update(chunk)
+        size += len(chunk)
+    fp.seek(0)
+    return digest.hexdigest(), size
+
+
+def make_cache_key(document_digest: str, model: str, index_version: str) -> str:
+    """
+    Cache key for a document (by digest) analyzed by the given provider/model
+    against the given guidelines index version (see get_index_version()).
+    """
+    return f"analysis:{settings.LLM_PROVIDER.value}:{model}:{index_version}:{document_digest}"
+
+
+class AnalysisCache:
+    """LRU + TTL cache of AnalysisResults, optionally backed by Redis."""
+
+    def __init__(self, max_size: int = 256, ttl_seconds: int = 86400, redis_url: str | None = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._local: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._redis = None
+        if redis_url:
+            try:
+                import redis.asyncio as aioredis
+                self._redis = aioredis.from_url(redis_url)
+                logger.info("Analysis cache using Redis backend: %s", redis_url)
+            except Exception as e:
+                logger.warning("Redis unavailable for analysis cache (%s). Using in-memory LRU.", e)
+
+    async def get(self, key: str) -> AnalysisResult | None:
+        if self._redis is not None:
+            try:
+                payload = await self._redis.get(key)
+                return AnalysisResult.model_validate_json(payload) if payload else None
+            except Exception as e:
+                logger.warning("Analysis cache read failed (%s), falling back to memory", e)
+
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return AnalysisResult.model_validate_json(payload)
+
+    async def set(self, key: str, result: AnalysisResult) -> None:
+        payload = result.model_dump_json()
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, payload, ex=self.ttl_seconds)
+                return
+            except Exception as e:
+                logger.warning("Analysis cache write failed (%s), falling back to memory", e)
+
+        self._local[key] = (time.monotonic() + self.ttl_seconds, payload)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def clear(self) -> None:
+        """Drop all cached analyses (e.g. after the guidelines change)."""
+        self._local.clear()
+        if self._redis is not None:
+            try:
+                async for key in self._redis.scan_iter(match="analysis:*"):
+                    await self._redis.delete(key)
+            except Exception as e:
+                logger.warning("Analysis cache clear failed: %s", e)
+
+
+analysis_cache = AnalysisCache(
+    max_size=settings.ANALYSIS_CACHE_SIZE,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    redis_url=settings.REDIS_URL if settings.ANALYSIS_CACHE_BACKEND == "redis" else None,
+)
+
+
+def get_analysis_cache() -> AnalysisCache:
+    return analysis_cache
@@ -1,9 +1,20 @@
 """
 Document parsing service: extracts text from PDF, DOCX, and TXT files.
+
+Sources may be raw bytes or a seekable binary file object (e.g. an upload's
+spooled temp file), so large uploads are parsed without an in-memory copy.
 """
 
 import io
+import os
+import shutil
 import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO
 
 from PyPDF2 import PdfReader
 
@@ -13,55 +24,189 @@ from app.config import get_settings
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+_pdf_executor: ProcessPoolExecutor | None = None
+_pdf_executor_lock = threading.Lock()
+
+# PDFium is not thread-safe (for any documents, not just a shared one) and
+# pypdfium2 does not lock around it, so in-process calls are serialised here.
+# extract_text() runs in worker threads for concurrent uploads.
+_pdfium_lock = threading.Lock()
+
+
+def _as_stream(source: bytes | BinaryIO) -> BinaryIO:
+    """Return a file object positioned at the start of the source."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
 
-def validate_file(filename: str, file_bytes: bytes) -> None:
+def _source_size(source: bytes | BinaryIO) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    size = source.seek(0, io.SEEK_END)
+    source.seek(0)
+    return size
+
+
+def validate_file(filename: str, source: bytes | BinaryIO) -> None:
     """Validate file type and size."""
     ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
     if ext not in settings.ALLOWED_EXTENSIONS:
         raise UnsupportedFileTypeError(filename)
 
-    size_mb = len(file_bytes) / (1024 * 1024)
+    size_mb = _source_size(source) / (1024 * 1024)
     if size_mb > settings.MAX_FILE_SIZE_MB:
         raise FileTooLargeError(settings.MAX_FILE_SIZE_MB)
 
 
-def extract_text(filename: str, file_bytes: bytes) -> str:
+def extract_text(filename: str, source: bytes | BinaryIO) -> str:
     """
     Extract text from a file based on its extension.
     Supports: PDF, DOCX, TXT
     """
-    validate_file(filename, file_bytes)
+    validate_file(filename, source)
 
     ext = filename.rsplit(".", 1)[-1].lower()
 
     if ext == "pdf":
-        return _extract_pdf(file_bytes)
+        return _extract_pdf(source)
     elif ext == "docx":
-        return _extract_docx(file_bytes)
+        return _extract_docx(source)
     elif ext == "txt":
-        return _extract_txt(file_bytes)
+        return _extract_txt(source)
     else:
         raise UnsupportedFileTypeError(filename)
 
 
-def _extract_pdf(file_bytes: bytes) -> str:
-    """Extract text from PDF bytes."""
+def _pdf_extract_workers() -> int:
+    """
+    Extraction processes per server worker. Every server worker has its own
+    pool, so the default shares the CPUs across WEB_CONCURRENCY workers, with
+    at least 2 (so large PDFs are still split) and at most 4 each on a
+    multi-core host. Pool processes are only started by large PDFs.
+    """
+    if settings.PDF_EXTRACT_WORKERS > 0:
+        return settings.PDF_EXTRACT_WORKERS
+    cpus = os.cpu_count() or 1
+    if cpus < 2:
+        return 1
+    return min(4, max(2, cpus // max(1, settings.WEB_CONCURRENCY)))
+
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """
+    Process pool for large PDFs. pdfium is not thread-safe, so pages are
+    split across processes rather than threads. Spawned (not forked) because
+    the server process runs threads.
+    """
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(
+                max_workers=_pdf_extract_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pdf_executor
+
+
+def shutdown_pdf_executor() -> None:
+    """Stop the PDF process pool; the next large PDF starts a new one."""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        executor, _pdf_executor = _pdf_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _pdfium_pages(pdf, start: int, stop: int) -> list[str]:
+    text_parts = []
+    for index in range(start, stop):
+        page = pdf[index]
+        textpage = page.get_textpage()
+        text_parts.append(textpage.get_text_range().replace("\r\n", "\n"))
+        textpage.close()
+        page.close()
+    return text_parts
+
+
+def _pdfium_page_range(path: str, start: int, stop: int) -> list[str]:
+    """Worker-process entry point: extract pages [start, stop) of the PDF at path."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(path)
     try:
-        reader = PdfReader(io.BytesIO(file_bytes))
-        text_parts = []
-        for i, page in enumerate(reader.pages):
-            page_text = page.extract_text()
-            if page_text:
-                text_parts.append(page_text)
-        
-        full_text = "\n".join(text_parts)
+        return _pdfium_pages(pdf, start, stop)
+    finally:
+        pdf.close()
+
+
+def _pdfium_parallel_page_texts(source: bytes | BinaryIO, page_count: int) -> list[str]:
+    """Extract page ranges of a large PDF concurrently in the process pool."""
+    # Workers open the PDF by path, so the document is not pickled per task
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        shutil.copyfileobj(_as_stream(source), tmp, 1024 * 1024)
+    try:
+        workers = _pdf_extract_workers()
+        step = -(-page_count // workers)
+        executor = _get_pdf_executor()
+        futures = [
+            executor.submit(_pdfium_page_range, tmp.name, start, min(start + step, page_count))
+            for start in range(0, page_count, step)
+        ]
+        return [text for future in futures for text in future.result()]
+    except BrokenProcessPool:
+        # A worker died (e.g. pdfium crashed on this file). Replace the pool so
+        # later PDFs are not stuck on the fallback path; this one falls back.
+        logger.warning("PDF extraction pool broke, restarting it")
+        shutdown_pdf_executor()
+        raise
+    finally:
+        os.remove(tmp.name)
+
+
+def _pdfium_page_texts(source: bytes | BinaryIO) -> list[str]:
+    """Extract per-page text with pdfium (native, much faster than PyPDF2)."""
+    import pypdfium2 as pdfium
+
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(source if isinstance(source, bytes) else _as_stream(source))
+        try:
+            page_count = len(pdf)
+            if page_count < settings.PDF_PARALLEL_MIN_PAGES or _pdf_extract_workers() < 2:
+                return _pdfium_pages(pdf, 0, page_count)
+        finally:
+            pdf.close()
+
+    logger.info("Extracting %d PDF pages across %d processes", page_count, _pdf_extract_workers())
+    return _pdfium_parallel_page_texts(source, page_count)
+
+
+def _pypdf2_page_texts(source: bytes | BinaryIO) -> list[str]:
+    """Extract per-page text with PyPDF2 (pure Python fallback)."""
+    reader = PdfReader(_as_stream(source))
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def _extract_pdf(source: bytes | BinaryIO) -> str:
+    """Extract text from a PDF using pdfium, falling back to PyPDF2."""
+    try:
+        try:
+            page_texts = _pdfium_page_texts(source)
+        except ImportError:
+            page_texts = _pypdf2_page_texts(source)
+        except Exception as e:
+            logger.warning("pdfium could not parse the PDF (%s), falling back to PyPDF2", e)
+            page_texts = _pypdf2_page_texts(source)
+
+        full_text = "\n".join(text for text in page_texts if text)
         if not full_text.strip():
             raise DocumentParsingError(
                 "Could not extract any text from the PDF. "
                 "The file may be scanned/image-based. OCR is not yet supported."
             )
         
-        logger.info("Extracted %d characters from %d PDF pages", len(full_text), len(reader.pages))
+        logger.info("Extracted %d characters from %d PDF pages", len(full_text), len(page_texts))
         return full_text
 
     except DocumentParsingError:
@@ -71,11 +216,11 @@ def _extract_pdf(file_bytes: bytes) -> str:
         raise DocumentParsingError(f"Failed to parse PDF: {str(e)}")
 
 
-def _extract_docx(file_bytes: bytes) -> str:
-    """Extract text from DOCX bytes."""
+def _extract_docx(source: bytes | BinaryIO) -> str:
+    """Extract text from a DOCX file."""
     try:
         import docx
-        doc = docx.Document(io.BytesIO(file_bytes))
+        doc = docx.Document(_as_stream(source))
         text_parts = [para.text for para in doc.paragraphs if para.text.strip()]
         
         # Also extract from tables
@@ -104,8 +249,9 @@ def _extract_docx(file_bytes: bytes) -> str:
         raise DocumentParsingError(f"Failed to parse DOCX: {str(e)}")
 
 
-def _extract_txt(file_bytes: bytes) -> str:
-    """Extract text from plain text bytes."""
+def _extract_txt(source: bytes | BinaryIO) -> str:
+    """Extract text from a plain text file."""
+    file_bytes = source if isinstance(source, bytes) else _as_stream(source).read()
     try:
         text = file_bytes.decode("utf-8")
         if not text.strip():
@@ -3,12 +3,26 @@ Vector database service: manages guideline embeddings and retrieval.
 """
 
 import os
+import time
+import hashlib
 import logging
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any
 
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
 from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pydantic import PrivateAttr
 
 from app.config import get_settings, LLMProvider
 
@@ -16,6 +30,212 @@ logger = logging.getLogger(__name__)
 settings = get_settings()
 
 _retriever = None
+_index_version = ""
+# (path, mtime_ns, size) of the guidelines file behind _retriever
+_index_source: tuple[str, int, int] | None = None
+_http_session: requests.Session | None = None
+
+
+def get_http_session() -> requests.Session:
+    """
+    Process-wide HTTP session for calls to the model server. Keep-alive
+    connections are pooled, so embedding and warm-up requests skip the TCP
+    handshake instead of opening a new connection each time.
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.HTTP_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session = session
+    return _http_session
+
+
+class OllamaBatchEmbeddings(Embeddings):
+    """
+    Ollama embeddings that send documents to the batch /api/embed endpoint.
+
+    One HTTP round trip per batch instead of per chunk; queries stay on the
+    single-text /api/embeddings endpoint.
+    """
+
+    def __init__(self, model: str, base_url: str, batch_size: int = 32,
+                 keep_alive: str | None = None, timeout: float = 120):
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.batch_size = max(1, batch_size)
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self._session = get_http_session()
+
+    def _post(self, endpoint: str, payload: dict) -> dict:
+        payload = {"model": self.model, **payload}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        response = self._session.post(f"{self.base_url}{endpoint}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            vectors.extend(self._post("/api/embed", {"input": batch})["embeddings"])
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._post("/api/embeddings", {"prompt": text})["embedding"]
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Vector store retriever that remembers recent queries.
+
+    Templated applications produce near-identical queries, so results are
+    reused for an exact (whitespace-normalized) repeat, or for a query whose
+    embedding is within `similarity_threshold` cosine similarity of a cached
+    one. A miss reuses the query embedding for the search, so it costs no more
+    than an uncached retriever.
+
+    Application chunks scored by select_relevant_text() are embedded through
+    embed_chunks(), which caches their vectors by content hash.
+    """
+
+    vectorstore: Any
+    k: int = 5
+    max_size: int = 256
+    ttl_seconds: float = 3600
+    similarity_threshold: float = 0.98
+    chunk_cache_size: int = 4096
+
+    # key -> (expires_at, unit-normalized query vector, docs)
+    _entries: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _guideline_vectors: Any = PrivateAttr(default=None)
+    # chunk digest -> unit-normalized chunk vector
+    _chunk_vectors: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+
+    def guideline_vectors(self) -> np.ndarray:
+        """Unit-normalized embeddings of every guideline chunk in the index."""
+        if self._guideline_vectors is None:
+            stored = self.vectorstore.get(include=["embeddings"])["embeddings"]
+            matrix = np.asarray(stored, dtype=np.float32).reshape(len(stored), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._guideline_vectors = matrix / np.where(norms == 0, 1.0, norms)
+        return self._guideline_vectors
+
+    def embed_chunks(self, chunks: list[str]) -> np.ndarray:
+        """Unit-normalized embeddings of text chunks; only unseen chunks are embedded."""
+        keys = [hashlib.blake2b(chunk.encode(), digest_size=16).hexdigest() for chunk in chunks]
+        with self._lock:
+            cached = {key: self._chunk_vectors[key] for key in keys if key in self._chunk_vectors}
+            for key in cached:
+                self._chunk_vectors.move_to_end(key)
+
+        missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in cached}
+        if missing:
+            vectors = np.asarray(
+                self.vectorstore.embeddings.embed_documents(list(missing.values())), dtype=np.float32
+            )
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+            fresh = dict(zip(missing, vectors))
+            cached.update(fresh)
+            with self._lock:
+                self._chunk_vectors.update(fresh)
+                while len(self._chunk_vectors) > self.chunk_cache_size:
+                    self._chunk_vectors.popitem(last=False)
+
+        return np.stack([cached[key] for key in keys])
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        key = hashlib.blake2b(" ".join(query.split()).encode(), digest_size=16).hexdigest()
+        now = time.monotonic()
+
+        with self._lock:
+            for stale in [k for k, (expires_at, _, _) in self._entries.items() if expires_at < now]:
+                del self._entries[stale]
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[2]
+
+        embeddings = self.vectorstore.embeddings
+        if embeddings is None:
+            docs = self.vectorstore.similarity_search(query, k=self.k)
+            self._store(key, None, docs)
+            return docs
+
+        vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        docs = self._lookup_similar(vector)
+        if docs is None:
+            docs = self.vectorstore.similarity_search_by_vector(vector.tolist(), k=self.k)
+        self._store(key, vector, docs)
+        return docs
+
+    def _lookup_similar(self, vector: np.ndarray) -> list[Document] | None:
+        with self._lock:
+            candidates = [(v, docs) for _, v, docs in self._entries.values()
+                          if v is not None and v.shape == vector.shape]
+        if not candidates:
+            return None
+        similarities = np.stack([v for v, _ in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return candidates[best][1]
+        return None
+
+    def _store(self, key: str, vector: np.ndarray | None, docs: list[Document]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector, docs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def select_relevant_text(text: str, retriever=None) -> str:
+    """
+    Shrink a long application to the parts that matter for the guidelines.
+
+    The application is split into chunks, each scored by its best cosine
+    similarity to any guideline chunk, and the highest-scoring chunks above
+    APPLICATION_RELEVANCE_THRESHOLD are kept (in document order) within
+    APPLICATION_MAX_INPUT_TOKENS. Chunk embeddings are cached, so repeated or
+    templated applications only embed what is new. Short applications are
+    returned unchanged.
+    """
+    # ~4 characters per token for English text
+    max_chars = settings.APPLICATION_MAX_INPUT_TOKENS * 4
+    if len(text) <= max_chars:
+        return text
+
+    retriever = retriever or _retriever
+    try:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
+        chunks = splitter.split_text(text)
+        guidelines = retriever.guideline_vectors()
+        scores = (retriever.embed_chunks(chunks) @ guidelines.T).max(axis=1)
+    except Exception as e:
+        logger.warning("Relevance selection failed (%s), truncating application text", e)
+        return text[:max_chars]
+
+    ranked = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+    relevant = [i for i in ranked if scores[i] >= settings.APPLICATION_RELEVANCE_THRESHOLD]
+
+    selected, used = [], 0
+    for i in relevant or ranked:
+        if used + len(chunks[i]) > max_chars:
+            continue
+        selected.append(i)
+        used += len(chunks[i])
+
+    logger.info("Selected %d/%d application chunks (%d -> %d chars)",
+                len(selected), len(chunks), len(text), used)
+    return "\n".join(chunks[i] for i in sorted(selected))
 
 
 def _get_embeddings():
@@ -45,48 +265,230 @@ def _get_embeddings():
         except Exception as e:
             logger.warning("OpenRouter embeddings failed (%s), falling back to Ollama", e)
 
+    # Default: Ollama
+    logger.info("Using Ollama embeddings: model=%s, batch_size=%d",
+                settings.OLLAMA_EMBED_MODEL, settings.OLLAMA_EMBED_BATCH_SIZE)
+    return OllamaBatchEmbeddings(
+        model=settings.OLLAMA_EMBED_MODEL,
+        base_url=settings.OLLAMA_HOST,
+        batch_size=settings.OLLAMA_EMBED_BATCH_SIZE,
+        keep_alive=settings.OLLAMA_KEEP_ALIVE,
+    )
 
-def build_vector_db(guidelines_path: str | None = None):
+
+def _embedding_id(embeddings) -> str:
+    """Identify the embedding model, since vectors from different models are not interchangeable."""
+    model = getattr(embeddings, "model", None)
+    return f"{type(embeddings).__name__}:{model}"
+
+
+def _collection_metadata() -> dict:
+    """HNSW index settings — cosine suits dense text embeddings better than Chroma's default L2."""
+    return {
+        "hnsw:space": settings.CHROMA_HNSW_SPACE,
+        "hnsw:M": settings.CHROMA_HNSW_M,
+        "hnsw:construction_ef": settings.CHROMA_HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": settings.CHROMA_HNSW_SEARCH_EF,
+    }
+
+
+def _guidelines_cache_key(path: str, index_id: str = "") -> str:
+    """Hash the guidelines file and index config so a persisted index is only reused when both match."""
+    digest = hashlib.sha256(index_id.encode())
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _load_persisted_db(persist_dir: str, embeddings):
+    """Open a previously persisted collection, or return None if it is missing or empty."""
+    if not os.path.isdir(persist_dir):
+        return None
+
+    vector_db = Chroma(
+        collection_name=settings.CHROMA_COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=persist_dir,
+        collection_metadata=_collection_metadata(),
+    )
+    # A directory left behind by an interrupted build has no vectors — rebuild it
+    if not vector_db.get(limit=1)["ids"]:
+        return None
+    logger.info("Loaded persisted vector database (persist_dir=%s)", persist_dir)
+    return vector_db
+
+
+def _read_lock_owner(lock_path: str) -> str | None:
+    try:
+        with open(lock_path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def _build_lock(persist_dir: str, stale_after: float = 600):
     """
-    Build (or reload) the vector database from the guidelines file.
-    Returns a retriever.
+    Cross-process lock around an index build, so several server workers
+    sharing CHROMA_PERSIST_DIR don't embed and write the same collection at once.
+
+    The lock file holds an owner token and its mtime is refreshed while the
+    build runs, so only a lock whose holder died is treated as stale, and a
+    holder never removes a lock that has since been taken over.
     """
-    global _retriever
+    lock_path = f"{persist_dir}.lock"
+    token = f"{os.getpid()}:{uuid.uuid4().hex}"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    logger.warning("Removing stale index build lock: %s", lock_path)
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.5)
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(token)
+        break
 
-    path = guidelines_path or settings.effective_guidelines_path
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(stale_after / 4):
+            if _read_lock_owner(lock_path) != token:
+                return
+            os.utime(lock_path)
+
+    refresher = threading.Thread(target=heartbeat, name="index-build-lock", daemon=True)
+    refresher.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        refresher.join()
+        if _read_lock_owner(lock_path) == token:
+            os.remove(lock_path)
+        else:
+            logger.warning("Index build lock was taken over, leaving it in place: %s", lock_path)
 
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Guidelines file not found at: {path}")
 
+def _create_db(path: str, embeddings, persist_dir: str | None):
+    """Split and embed the guidelines file into a new Chroma collection."""
     logger.info("Loading guidelines from: %s", path)
     loader = TextLoader(path)
     documents = loader.load()
 
     logger.info("Splitting documents into chunks...")
     splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
+        chunk_size=settings.GUIDELINE_CHUNK_SIZE,
+        chunk_overlap=settings.GUIDELINE_CHUNK_OVERLAP,
     )
     chunks = splitter.split_documents(documents)
     logger.info("Created %d chunks", len(chunks))
 
-    embeddings = _get_embeddings()
-
-    logger.info("Building vector database (persist_dir=%s)...", settings.CHROMA_PERSIST_DIR)
-    vector_db = Chroma.from_documents(
+    logger.info("Building vector database (persist_dir=%s)...", persist_dir)
+    return Chroma.from_documents(
         documents=chunks,
         embedding=embeddings,
         collection_name=settings.CHROMA_COLLECTION_NAME,
-        persist_directory=settings.CHROMA_PERSIST_DIR if settings.CHROMA_PERSIST_DIR else None,
+        persist_directory=persist_dir,
+        collection_metadata=_collection_metadata(),
     )
 
-    _retriever = vector_db.as_retriever(
-        search_kwargs={"k": settings.VECTOR_SEARCH_K}
+
+def build_vector_db(guidelines_path: str | None = None):
+    """
+    Build (or reload) the vector database from the guidelines file.
+
+    When CHROMA_PERSIST_DIR is set, the index is persisted under a subdirectory
+    keyed by the guidelines hash, so restarts reuse it instead of re-embedding.
+    Returns a retriever.
+    """
+    global _retriever, _index_version, _index_source
+
+    path = guidelines_path or settings.effective_guidelines_path
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Guidelines file not found at: {path}")
+    # Taken before hashing, so a write during the build is still noticed later
+    source = _file_signature(path)
+
+    embeddings = _get_embeddings()
+
+    index_id = (
+        f"{_embedding_id(embeddings)}|{sorted(_collection_metadata().items())}"
+        f"|{settings.GUIDELINE_CHUNK_SIZE}/{settings.GUIDELINE_CHUNK_OVERLAP}"
+    )
+    cache_key = _guidelines_cache_key(path, index_id)
+
+    persist_dir = None
+    if settings.CHROMA_PERSIST_DIR:
+        persist_dir = os.path.join(settings.CHROMA_PERSIST_DIR, cache_key)
+
+    if not persist_dir:
+        vector_db = _create_db(path, embeddings, None)
+    else:
+        vector_db = _load_persisted_db(persist_dir, embeddings)
+        if vector_db is None:
+            # Server workers start together — one builds the index, the rest load it
+            with _build_lock(persist_dir):
+                vector_db = _load_persisted_db(persist_dir, embeddings)
+                if vector_db is None:
+                    vector_db = _create_db(path, embeddings, persist_dir)
+
+    _retriever = CachedRetriever(
+        vectorstore=vector_db,
+        k=settings.VECTOR_SEARCH_K,
+        max_size=settings.RETRIEVAL_CACHE_SIZE,
+        ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+        similarity_threshold=settings.RETRIEVAL_CACHE_SIMILARITY,
     )
+    _index_version = cache_key
+    _index_source = source
     logger.info("Vector database ready (k=%d)", settings.VECTOR_SEARCH_K)
     return _retriever
 
 
+def warm_up_embeddings() -> None:
+    """
+    Load the local embedding model ahead of the first query.
+    With a persisted index nothing is embedded at startup, so the model
+    would otherwise be loaded by the first analysis request.
+    """
+    embeddings = _get_embeddings()
+    if isinstance(embeddings, OllamaBatchEmbeddings):
+        embeddings.embed_query("warm-up")
+        logger.info("Embedding model loaded: %s", embeddings.model)
+
+
+def _file_signature(path: str) -> tuple[str, int, int]:
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def guidelines_changed() -> bool:
+    """
+    True if the guidelines file behind the current retriever changed on disk
+    since it was built, e.g. an upload handled by another server worker.
+    """
+    if _index_source is None:
+        return False
+    try:
+        return _file_signature(_index_source[0]) != _index_source
+    except FileNotFoundError:
+        return False
+
+
+def get_index_version() -> str:
+    """Hash of the guidelines and index config behind the current retriever ("" if none built)."""
+    return _index_version
+
+
 def get_retriever():
     """Get the current retriever instance."""
     global _retriever
@@ -88,3 +88,27 @@ async def test_admin_access_denied_for_analyst(client: AsyncClient, token: str):
     response = await client.get("/api/v1/admin/users", headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == 403
     assert response.json()["detail"] == "Access requires one of: ['admin']"
+
+
+async def test_upload_guidelines_rebuilds_off_event_loop(client: AsyncClient, admin_token: str, tmp_path):
+    import threading
+    from unittest.mock import patch
+    from app.routers import admin
+
+    rebuild_threads = []
+
+    def fake_build_vector_db():
+        rebuild_threads.append(threading.current_thread())
+        return object()
+
+    with patch.object(admin.settings, "GUIDELINES_PATH", str(tmp_path / "guidelines.txt")), \
+         patch.object(admin, "build_vector_db", fake_build_vector_db), \
+         patch.object(admin, "build_rag_chain"):
+        response = await client.post(
+            "/api/v1/admin/guidelines",
+            files={"file": ("guidelines.txt", b"Minimum credit score is 700.", "text/plain")},
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+    assert response.status_code == 200
+    assert (tmp_path / "guidelines.txt").read_bytes() == b"Minimum credit score is 700."
+    assert rebuild_threads and rebuild_threads[0] is not threading.main_thread()
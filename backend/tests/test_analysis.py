@@ -3,6 +3,9 @@ Tests for analysis endpoints.
 """
 
 import pytest
+from unittest.mock import AsyncMock, patch
+
+from app.models.schemas import AnalysisResult
 
 
 @pytest.mark.asyncio
@@ -44,3 +47,83 @@ async def test_analysis_not_found(client, auth_headers):
     """Returns 404 for a non-existent analysis."""
     response = await client.get("/api/v1/analysis/99999", headers=auth_headers)
     assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_repeat_upload_is_served_from_cache(client, auth_headers):
+    """Uploading the same document twice runs the AI pipeline only once."""
+    result = AnalysisResult(
+        summary="cached", overall_risk_score=30, overall_risk_level="moderate",
+        recommendation="APPROVE", detailed_analysis="",
+    )
+    files = {"file": ("app.txt", b"Credit Score: 780 (cache test)", "text/plain")}
+    with patch("app.routers.analysis.analyze_document", AsyncMock(return_value=result)) as analyze:
+        first = await client.post("/api/v1/analysis", files=files, headers=auth_headers)
+        second = await client.post("/api/v1/analysis", files=files, headers=auth_headers)
+
+    assert first.status_code == second.status_code == 201
+    assert second.json()["analysis"]["summary"] == "cached"
+    assert analyze.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_oversize_upload_rejected_before_analysis(client, auth_headers):
+    """Uploads over MAX_FILE_SIZE_MB get a 413 from Content-Length alone."""
+    from app.middleware import upload_limit
+
+    files = {"file": ("big.txt", b"x" * (2 * 1024 * 1024), "text/plain")}
+    with patch.object(upload_limit.settings, "MAX_FILE_SIZE_MB", 1), \
+         patch("app.routers.analysis.analyze_document", AsyncMock()) as analyze:
+        response = await client.post("/api/v1/analysis", files=files, headers=auth_headers)
+
+    assert response.status_code == 413
+    assert response.json()["error"] is True
+    analyze.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_oversize_chunked_upload_rejected_while_streaming(client, auth_headers):
+    """Uploads without a Content-Length are cut off once the limit is passed."""
+    from app.middleware import upload_limit
+
+    boundary = "limit-test"
+    sent = []
+
+    async def body():
+        yield (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+            f"filename=\"big.txt\"\r\nContent-Type: text/plain\r\n\r\n"
+        ).encode()
+        for _ in range(8):
+            sent.append(1)
+            yield b"x" * (512 * 1024)
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    headers = {**auth_headers, "Content-Type": f"multipart/form-data; boundary={boundary}"}
+    with patch.object(upload_limit.settings, "MAX_FILE_SIZE_MB", 1), \
+         patch("app.routers.analysis.analyze_document", AsyncMock()) as analyze:
+        response = await client.post("/api/v1/analysis", content=body(), headers=headers)
+
+    assert "content-length" not in response.request.headers
+    assert response.status_code == 413
+    assert len(sent) < 8  # the rest of the body was never read
+    assert response.json()["error"] is True
+    analyze.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_failed_analysis_is_not_cached(client, auth_headers):
+    """A fallback result produced while the AI pipeline is down is not cached."""
+    from app.services.ai_service import AIServiceError
+    from app.services.cache_service import get_analysis_cache
+
+    files = {"file": ("app.txt", b"Credit Score: 640 (outage test)", "text/plain")}
+    cache = get_analysis_cache()
+    with patch("app.services.ai_service._rag_chain", None), \
+         patch("app.services.vector_service.get_retriever", side_effect=AIServiceError("down")), \
+         patch.object(cache, "set", AsyncMock(wraps=cache.set)) as cache_set:
+        response = await client.post("/api/v1/analysis", files=files, headers=auth_headers)
+
+    assert response.status_code == 201
+    assert "AI service error" in response.json()["analysis"]["summary"]
+    cache_set.assert_not_called()
@@ -0,0 +1,501 @@
+"""
+Tests for the service layer (vector DB, document parsing, AI helpers).
+External model servers are never contacted — embeddings are faked.
+"""
+
+import io
+import os
+import time
+import pytest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+from app.config import LLMProvider
+from app.exceptions import DocumentParsingError
+from app.models.schemas import AnalysisResult
+from app.services import ai_service, document_service, vector_service
+from app.services.cache_service import AnalysisCache, hash_document, make_cache_key
+
+
+# ══════════════════════════════════════════════════════════════════
+#  Vector Service
+# ══════════════════════════════════════════════════════════════════
+
+@pytest.fixture
+def guidelines_file(tmp_path):
+    path = tmp_path / "guidelines.txt"
+    path.write_text("Minimum credit score is 620.\n\nMaximum DTI ratio is 43%.\n")
+    return path
+
+
+@pytest.fixture
+def persist_dir(tmp_path):
+    with patch.object(vector_service.settings, "CHROMA_PERSIST_DIR", str(tmp_path / "chroma")):
+        yield tmp_path / "chroma"
+
+
+@pytest.fixture
+def fake_embeddings():
+    with patch.object(vector_service, "_get_embeddings",
+                      return_value=DeterministicFakeEmbedding(size=16)):
+        yield
+
+
+class TestPersistedVectorDB:
+    """The guidelines index is persisted per content hash and reused."""
+
+    def test_cache_key_changes_with_content(self, guidelines_file):
+        first = vector_service._guidelines_cache_key(str(guidelines_file))
+        guidelines_file.write_text("Maximum LTV ratio is 80%.\n")
+        assert vector_service._guidelines_cache_key(str(guidelines_file)) != first
+
+    def test_reuses_persisted_index(self, guidelines_file, persist_dir, fake_embeddings):
+        vector_service.build_vector_db(str(guidelines_file))
+        assert len(list(persist_dir.iterdir())) == 1
+
+        with patch.object(vector_service.Chroma, "from_documents") as from_documents:
+            retriever = vector_service.build_vector_db(str(guidelines_file))
+        from_documents.assert_not_called()
+        assert retriever.invoke("credit score")
+
+    def test_rebuilds_when_guidelines_change(self, guidelines_file, persist_dir, fake_embeddings):
+        vector_service.build_vector_db(str(guidelines_file))
+        guidelines_file.write_text("Maximum LTV ratio is 80%.\n")
+        vector_service.build_vector_db(str(guidelines_file))
+        assert len(list(persist_dir.iterdir())) == 2
+
+    def test_index_version_tracks_guidelines(self, guidelines_file, persist_dir, fake_embeddings):
+        vector_service.build_vector_db(str(guidelines_file))
+        first = vector_service.get_index_version()
+        guidelines_file.write_text("Maximum LTV ratio is 80%.\n")
+        vector_service.build_vector_db(str(guidelines_file))
+        assert first and vector_service.get_index_version() != first
+
+    def test_collection_uses_cosine_space(self, guidelines_file, persist_dir, fake_embeddings):
+        retriever = vector_service.build_vector_db(str(guidelines_file))
+        assert retriever.vectorstore._collection.metadata["hnsw:space"] == "cosine"
+
+    def test_build_lock_is_released(self, tmp_path):
+        target = str(tmp_path / "index")
+        with vector_service._build_lock(target):
+            assert (tmp_path / "index.lock").exists()
+        assert not (tmp_path / "index.lock").exists()
+
+    def test_stale_build_lock_is_taken_over(self, tmp_path):
+        lock = tmp_path / "index.lock"
+        lock.write_text("")
+        os.utime(lock, (0, 0))
+        with vector_service._build_lock(str(tmp_path / "index")):
+            pass
+        assert not lock.exists()
+
+    def test_lock_refreshed_while_held(self, tmp_path):
+        lock = tmp_path / "index.lock"
+        with vector_service._build_lock(str(tmp_path / "index"), stale_after=0.2):
+            os.utime(lock, (0, 0))
+            time.sleep(0.2)
+            assert os.path.getmtime(lock) > 0
+
+    def test_lock_taken_over_is_not_removed(self, tmp_path):
+        lock = tmp_path / "index.lock"
+        with vector_service._build_lock(str(tmp_path / "index")):
+            lock.write_text("other-worker")
+        assert lock.read_text() == "other-worker"
+
+
+class FixedEmbeddings(Embeddings):
+    """Embeddings with hand-picked vectors so similarity is predictable."""
+
+    def __init__(self, vectors: dict[str, list[float]]):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[t] for t in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+class TestCachedRetriever:
+    """Retrieval results are reused for repeated and near-identical queries."""
+
+    def _retriever(self, vectors, **kwargs):
+        store = MagicMock()
+        store.embeddings = FixedEmbeddings(vectors)
+        store.similarity_search_by_vector.side_effect = (
+            lambda vector, k: [Document(page_content=f"hit {len(store.similarity_search_by_vector.call_args_list)}")]
+        )
+        return vector_service.CachedRetriever(vectorstore=store, k=3, **kwargs), store
+
+    def test_exact_repeat_skips_search(self):
+        retriever, store = self._retriever({"credit  score": [1.0, 0.0]})
+        first = retriever.invoke("credit  score")
+        second = retriever.invoke("credit  score")
+        assert first == second
+        assert store.similarity_search_by_vector.call_count == 1
+
+    def test_near_duplicate_reuses_results(self):
+        retriever, store = self._retriever({"a": [1.0, 0.0], "b": [0.999, 0.01]})
+        assert retriever.invoke("a") == retriever.invoke("b")
+        assert store.similarity_search_by_vector.call_count == 1
+
+    def test_dissimilar_query_searches_again(self):
+        retriever, store = self._retriever({"a": [1.0, 0.0], "b": [0.0, 1.0]})
+        assert retriever.invoke("a") != retriever.invoke("b")
+        assert store.similarity_search_by_vector.call_count == 2
+
+    def test_expired_entries_are_not_reused(self):
+        retriever, store = self._retriever({"a": [1.0, 0.0]}, ttl_seconds=-1)
+        retriever.invoke("a")
+        retriever.invoke("a")
+        assert store.similarity_search_by_vector.call_count == 2
+
+
+class TestSelectRelevantText:
+    """Long applications are reduced to guideline-relevant chunks."""
+
+    def _retriever(self, chunk_vectors):
+        store = MagicMock()
+        store.get.return_value = {"embeddings": [[1.0, 0.0]]}
+        store.embeddings.embed_documents.side_effect = lambda chunks: [chunk_vectors(c) for c in chunks]
+        return vector_service.CachedRetriever(vectorstore=store)
+
+    def test_short_text_is_unchanged(self):
+        with patch.object(vector_service.settings, "APPLICATION_MAX_INPUT_TOKENS", 100):
+            assert vector_service.select_relevant_text("short", self._retriever(None)) == "short"
+
+    # Relevance rises through the document, so ranked order != document order
+    CHUNK_VECTORS = {"[1]": [0.8, 0.6], "[3]": [0.9, 0.436], "[5]": [1.0, 0.0]}
+
+    def _application(self):
+        return "\n\n".join(
+            f"[{i}] " + ("credit " if i % 2 else "filler ") * 120 for i in range(6)
+        )
+
+    def _chunk_vector(self, chunk):
+        return self.CHUNK_VECTORS.get(chunk[:3], [0.0, 1.0])
+
+    def test_keeps_relevant_chunks_in_order(self):
+        retriever = self._retriever(self._chunk_vector)
+        with patch.object(vector_service.settings, "APPLICATION_MAX_INPUT_TOKENS", 650):
+            selected = vector_service.select_relevant_text(self._application(), retriever)
+        assert "filler" not in selected
+        markers = [line[:3] for line in selected.split("\n")]
+        assert markers == ["[1]", "[3]", "[5]"]
+
+    def test_repeated_application_reuses_chunk_embeddings(self):
+        retriever = self._retriever(self._chunk_vector)
+        with patch.object(vector_service.settings, "APPLICATION_MAX_INPUT_TOKENS", 650):
+            first = vector_service.select_relevant_text(self._application(), retriever)
+            second = vector_service.select_relevant_text(self._application(), retriever)
+        assert first == second
+        assert retriever.vectorstore.embeddings.embed_documents.call_count == 1
+
+    def test_falls_back_to_truncation(self):
+        with patch.object(vector_service.settings, "APPLICATION_MAX_INPUT_TOKENS", 10):
+            assert vector_service.select_relevant_text("x" * 100, object()) == "x" * 40
+
+
+class TestOllamaBatchEmbeddings:
+    """Documents are embedded in batches through /api/embed."""
+
+    def test_batches_documents(self):
+        embedder = vector_service.OllamaBatchEmbeddings(
+            model="mistral", base_url="http://ollama:11434/", batch_size=2,
+        )
+        with patch.object(embedder._session, "post") as mock_post:
+            mock_post.return_value.json.side_effect = [
+                {"embeddings": [[1.0], [2.0]]},
+                {"embeddings": [[3.0]]},
+            ]
+            vectors = embedder.embed_documents(["a", "b", "c"])
+
+        assert vectors == [[1.0], [2.0], [3.0]]
+        assert mock_post.call_count == 2
+        url = mock_post.call_args_list[0].args[0]
+        assert url == "http://ollama:11434/api/embed"
+        assert mock_post.call_args_list[1].kwargs["json"] == {"model": "mistral", "input": ["c"]}
+
+    def test_query_uses_single_endpoint(self):
+        embedder = vector_service.OllamaBatchEmbeddings(model="mistral", base_url="http://ollama:11434")
+        with patch.object(embedder._session, "post") as mock_post:
+            mock_post.return_value.json.return_value = {"embedding": [0.5, 0.5]}
+            assert embedder.embed_query("credit score") == [0.5, 0.5]
+        assert mock_post.call_args.args[0] == "http://ollama:11434/api/embeddings"
+
+    def test_keep_alive_is_forwarded(self):
+        embedder = vector_service.OllamaBatchEmbeddings(
+            model="nomic-embed-text", base_url="http://ollama:11434", keep_alive="30m",
+        )
+        with patch.object(embedder._session, "post") as mock_post:
+            mock_post.return_value.json.return_value = {"embeddings": [[1.0]]}
+            embedder.embed_documents(["a"])
+        assert mock_post.call_args.kwargs["json"]["keep_alive"] == "30m"
+
+
+# ══════════════════════════════════════════════════════════════════
+#  Document Service
+# ══════════════════════════════════════════════════════════════════
+
+SAMPLE_PDF = Path(__file__).resolve().parent.parent / "data" / "sample_app.pdf"
+
+
+class TestPdfExtraction:
+    """PDF text extraction uses pdfium with a PyPDF2 fallback."""
+
+    def test_extracts_sample_application(self):
+        text = document_service.extract_text("sample_app.pdf", SAMPLE_PDF.read_bytes())
+        assert "Credit Score: 750" in text
+        assert "\r" not in text
+
+    def test_extracts_from_file_object(self):
+        with SAMPLE_PDF.open("rb") as fp:
+            text = document_service.extract_text("sample_app.pdf", fp)
+        assert "Credit Score: 750" in text
+
+    def test_parallel_extraction_matches_serial(self):
+        import pypdfium2 as pdfium
+
+        source = pdfium.PdfDocument(str(SAMPLE_PDF))
+        pdf = pdfium.PdfDocument.new()
+        pdf.import_pages(source, [0] * 6)
+        buffer = io.BytesIO()
+        pdf.save(buffer)
+        pdf_bytes = buffer.getvalue()
+
+        serial = document_service._pdfium_page_texts(pdf_bytes)
+        try:
+            with patch.object(document_service.settings, "PDF_PARALLEL_MIN_PAGES", 2), \
+                 patch.object(document_service.settings, "PDF_EXTRACT_WORKERS", 2):
+                parallel = document_service._pdfium_page_texts(pdf_bytes)
+        finally:
+            document_service.shutdown_pdf_executor()
+        assert parallel == serial
+        assert len(parallel) == 6
+
+    @pytest.mark.parametrize("cpus, expected", [(1, 1), (2, 2), (8, 2), (16, 4), (64, 4)])
+    def test_default_workers_split_large_pdfs(self, cpus, expected):
+        assert document_service.settings.PDF_EXTRACT_WORKERS == 0
+        with patch.object(document_service.os, "cpu_count", return_value=cpus):
+            assert document_service._pdf_extract_workers() == expected
+
+    def test_default_settings_extract_in_parallel(self):
+        pdf_bytes = SAMPLE_PDF.read_bytes()
+        try:
+            with patch.object(document_service.os, "cpu_count", return_value=8), \
+                 patch.object(document_service.settings, "PDF_PARALLEL_MIN_PAGES", 1), \
+                 patch.object(document_service, "_pdfium_parallel_page_texts",
+                              wraps=document_service._pdfium_parallel_page_texts) as parallel:
+                text = document_service.extract_text("sample_app.pdf", pdf_bytes)
+        finally:
+            document_service.shutdown_pdf_executor()
+        parallel.assert_called_once()
+        assert "Credit Score: 750" in text
+
+    def test_concurrent_extraction_from_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        pdf_bytes = SAMPLE_PDF.read_bytes()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            texts = list(pool.map(
+                lambda _: document_service.extract_text("sample_app.pdf", pdf_bytes), range(16)
+            ))
+        assert len(set(texts)) == 1
+        assert "Credit Score: 750" in texts[0]
+
+    def test_broken_pool_is_replaced(self):
+        from concurrent.futures.process import BrokenProcessPool
+
+        broken = MagicMock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool("worker died")
+        with patch.object(document_service, "_pdf_executor", broken), \
+             patch.object(document_service.settings, "PDF_EXTRACT_WORKERS", 2):
+            with pytest.raises(BrokenProcessPool):
+                document_service._pdfium_parallel_page_texts(SAMPLE_PDF.read_bytes(), 4)
+            assert document_service._pdf_executor is None
+        broken.shutdown.assert_called_once()
+
+    def test_falls_back_to_pypdf2(self):
+        with patch.object(document_service, "_pdfium_page_texts", side_effect=RuntimeError("boom")):
+            text = document_service.extract_text("sample_app.pdf", SAMPLE_PDF.read_bytes())
+        assert "John Doe" in text
+
+    def test_rejects_invalid_pdf(self):
+        with pytest.raises(DocumentParsingError):
+            document_service.extract_text("broken.pdf", b"%PDF-1.4 not really a pdf")
+
+
+# ══════════════════════════════════════════════════════════════════
+#  Analysis Cache
+# ══════════════════════════════════════════════════════════════════
+
+def _result(score: int = 40) -> AnalysisResult:
+    return AnalysisResult(
+        summary="ok", overall_risk_score=score, overall_risk_level="moderate",
+        recommendation="MANUAL_REVIEW", detailed_analysis="",
+    )
+
+
+class TestAnalysisCache:
+    """Analysis results are cached per document bytes, model and guidelines."""
+
+    def test_key_depends_on_bytes_model_and_guidelines(self):
+        doc, _ = hash_document(io.BytesIO(b"doc"))
+        doc2, _ = hash_document(io.BytesIO(b"doc2"))
+        assert make_cache_key(doc, "mistral", "v1") == make_cache_key(doc, "mistral", "v1")
+        assert make_cache_key(doc, "mistral", "v1") != make_cache_key(doc2, "mistral", "v1")
+        assert make_cache_key(doc, "mistral", "v1") != make_cache_key(doc, "gpt-4o", "v1")
+        assert make_cache_key(doc, "mistral", "v1") != make_cache_key(doc, "mistral", "v2")
+
+    def test_hash_document_streams_in_chunks(self):
+        fp = io.BytesIO(b"x" * 10)
+        digest, size = hash_document(fp, chunk_size=3)
+        assert size == 10
+        assert fp.tell() == 0
+        assert digest == hash_document(io.BytesIO(b"x" * 10))[0]
+
+    async def test_round_trip(self):
+        cache = AnalysisCache()
+        await cache.set("k", _result(70))
+        cached = await cache.get("k")
+        assert cached.overall_risk_score == 70
+
+    async def test_evicts_least_recently_used(self):
+        cache = AnalysisCache(max_size=2)
+        await cache.set("a", _result())
+        await cache.set("b", _result())
+        await cache.get("a")
+        await cache.set("c", _result())
+        assert await cache.get("a") is not None
+        assert await cache.get("b") is None
+
+    async def test_expired_entries_are_dropped(self):
+        cache = AnalysisCache(ttl_seconds=-1)
+        await cache.set("k", _result())
+        assert await cache.get("k") is None
+
+
+# ══════════════════════════════════════════════════════════════════
+#  RAG Pipeline
+# ══════════════════════════════════════════════════════════════════
+
+class FakeLLM:
+    """Records the prompt it receives and replies with a fixed message."""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt.to_string())
+        return AIMessage(content=self.reply)
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+    async def astream(self, prompt):
+        self.prompts.append(prompt.to_string())
+        for token in self.reply.split(" "):
+            yield AIMessageChunk(content=token)
+
+
+class TestWarmUpLLM:
+    """Startup warm-up loads the Ollama model with the runtime options."""
+
+    def test_loads_model_with_runtime_num_ctx(self):
+        with patch.object(ai_service.settings, "LLM_PROVIDER", LLMProvider.OLLAMA), \
+             patch.object(ai_service, "get_http_session") as get_session:
+            ai_service.warm_up_llm()
+        url = get_session.return_value.post.call_args.args[0]
+        payload = get_session.return_value.post.call_args.kwargs["json"]
+        assert url.endswith("/api/generate")
+        assert payload["model"] == ai_service.settings.OLLAMA_MODEL
+        assert payload["keep_alive"] == ai_service.settings.OLLAMA_KEEP_ALIVE
+        assert payload["options"] == {"num_ctx": ai_service.settings.OLLAMA_NUM_CTX}
+        assert "prompt" not in payload
+
+    def test_skips_hosted_providers(self):
+        with patch.object(ai_service.settings, "LLM_PROVIDER", LLMProvider.OPENAI), \
+             patch.object(ai_service, "get_http_session") as get_session:
+            ai_service.warm_up_llm()
+        get_session.assert_not_called()
+
+
+class TestParseLLMResponse:
+    """Unparseable LLM output yields a fallback result flagged as degraded."""
+
+    def test_json_result_is_not_degraded(self):
+        result = ai_service._parse_llm_response(
+            '{"summary": "ok", "overall_risk_score": 20, "overall_risk_level": "low", '
+            '"recommendation": "APPROVE", "detailed_analysis": ""}'
+        )
+        assert not result.degraded
+
+    def test_unstructured_result_is_degraded(self):
+        result = ai_service._parse_llm_response("not json")
+        assert result.degraded
+        assert "degraded" not in result.model_dump()
+
+
+class TestRAGPipeline:
+    """The hand-built pipeline retrieves guidelines and prompts the LLM."""
+
+    def _pipeline(self, reply='{"summary": "ok"}'):
+        retriever = MagicMock()
+        retriever.invoke.return_value = [Document(page_content="Minimum credit score is 620.")]
+        llm = FakeLLM(reply)
+        # Don't leak the fake pipeline into the module-level chain
+        with patch.object(ai_service, "_get_llm", return_value=llm), \
+             patch.object(ai_service, "_rag_chain", None):
+            pipeline = ai_service.build_rag_chain(retriever)
+        return pipeline, retriever, llm
+
+    def test_invoke_formats_context_and_input(self):
+        pipeline, retriever, llm = self._pipeline()
+        assert pipeline.invoke("Credit Score: 580") == '{"summary": "ok"}'
+        retriever.invoke.assert_called_once_with("Credit Score: 580")
+        assert "Minimum credit score is 620." in llm.prompts[0]
+        assert "Credit Score: 580" in llm.prompts[0]
+
+    def test_rendered_prompt_matches_format(self):
+        rendered = ai_service.render_prompt("GUIDELINES", "Income: $60,000")
+        assert rendered == ai_service.SYSTEM_PROMPT.format(context="GUIDELINES", input="Income: $60,000")
+
+    async def test_ainvoke(self):
+        pipeline, _, _ = self._pipeline()
+        assert await pipeline.ainvoke("Credit Score: 580") == '{"summary": "ok"}'
+
+    async def test_astream_yields_text_chunks(self):
+        pipeline, _, _ = self._pipeline("a b c")
+        chunks = [chunk async for chunk in pipeline.astream("Credit Score: 580")]
+        assert chunks == ["a", "b", "c"]
+
+
+class TestGuidelinesRefresh:
+    """Workers pick up guidelines changed on disk by another worker."""
+
+    def test_rebuilds_when_file_changes(self, guidelines_file, persist_dir, fake_embeddings):
+        with patch.object(vector_service.settings, "GUIDELINES_PATH", str(guidelines_file)), \
+             patch.object(vector_service, "_retriever", None), \
+             patch.object(vector_service, "_index_version", ""), \
+             patch.object(vector_service, "_index_source", None), \
+             patch.object(ai_service, "_rag_chain", None), \
+             patch.object(ai_service, "_get_llm", return_value=FakeLLM("{}")):
+            ai_service.build_rag_chain(vector_service.build_vector_db())
+            first_chain = ai_service.get_rag_chain()
+            first = vector_service.get_index_version()
+
+            ai_service.refresh_if_guidelines_changed()
+            assert ai_service.get_rag_chain() is first_chain
+
+            guidelines_file.write_text("Maximum LTV ratio is 80%.\n")
+            assert vector_service.guidelines_changed()
+            ai_service.refresh_if_guidelines_changed()
+
+            assert vector_service.get_index_version() != first
+            assert ai_service.get_rag_chain() is not first_chain
+            assert not vector_service.guidelines_changed()
@@ -4,6 +4,7 @@ Tests for background task SSE streaming.
 
 import asyncio
 import pytest
+from unittest.mock import patch
 from httpx import AsyncClient
 
 from app.models.database import BackgroundTask
@@ -41,3 +42,42 @@ async def test_streaming_endpoint_404(client: AsyncClient, token: str):
         params={"token": token}
     )
     assert response.status_code == 404
+
+
+async def test_stream_analysis_requires_auth(client: AsyncClient):
+    response = await client.post(
+        "/api/v1/stream/analysis",
+        files={"file": ("app.txt", b"Credit Score: 700", "text/plain")},
+    )
+    assert response.status_code == 401
+
+
+async def test_stream_analysis_yields_chain_output(client: AsyncClient, token: str):
+    class FakeChain:
+        async def astream(self, text):
+            for chunk in ('{"summary": ', '"ok"}'):
+                yield chunk
+
+    with patch("app.services.ai_service._rag_chain", FakeChain()):
+        response = await client.post(
+            "/api/v1/stream/analysis",
+            files={"file": ("app.txt", b"Credit Score: 700", "text/plain")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    assert response.status_code == 200
+    assert response.text == '{"summary": "ok"}'
+
+
+async def test_stream_analysis_aborts_on_chain_failure(client: AsyncClient, token: str):
+    class FailingChain:
+        async def astream(self, text):
+            yield '{"summary": '
+            raise RuntimeError("LLM connection lost")
+
+    with patch("app.services.ai_service._rag_chain", FailingChain()):
+        with pytest.raises(RuntimeError, match="LLM connection lost"):
+            await client.post(
+                "/api/v1/stream/analysis",
+                files={"file": ("app.txt", b"Credit Score: 700", "text/plain")},
+                headers={"Authorization": f"Bearer {token}"},
+            )